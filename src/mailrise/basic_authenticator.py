@@ -2,14 +2,20 @@
 This is the authentication functionality for the SMTP server.
 """
 
+import hmac
 import typing as typ
 
 from aiosmtpd import smtp
 
 
 class BasicAuthenticator(typ.NamedTuple):
-    """A simple authenticator that uses a static username and password list."""
-    logins: typ.Mapping[str, str]
+    """A simple authenticator that uses a static username and password list.
+
+    Attributes:
+        logins: The UTF-8 encoded usernames and passwords, which are kept as
+            bytes so that credentials can be compared without decoding them.
+    """
+    logins: typ.Mapping[bytes, bytes]
 
     # pylint: disable=too-many-arguments
     def __call__(self, server: smtp.SMTP, session: smtp.Session,
@@ -20,9 +26,9 @@ class BasicAuthenticator(typ.NamedTuple):
         if not isinstance(auth_data, smtp.LoginPassword):
             return fail_nothandled
 
-        username = auth_data.login.decode("utf-8")
-        password = auth_data.password.decode("utf-8")
-        success = self.logins.get(username) == password
+        password = self.logins.get(auth_data.login)
+        success = password is not None \
+            and hmac.compare_digest(password, auth_data.password)
         return smtp.AuthResult(success=success)
 
     def __str__(self) -> str:
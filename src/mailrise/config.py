@@ -4,12 +4,9 @@ This is the YAML configuration parser for Mailrise.
 
 from __future__ import annotations
 
-import importlib.util
-import io
 import os
 import typing as typ
 from enum import Enum
-from functools import partial
 from logging import Logger
 from typing import NamedTuple
 
@@ -20,35 +17,60 @@ from mailrise.basic_authenticator import BasicAuthenticator
 from mailrise.router import Router
 from mailrise.simple_router import load_from_yaml as load_simple_router
 
+# Prefer the libyaml-backed C loader, which is considerably faster than the
+# pure-Python implementation, but fall back if PyYAML was built without it.
+try:
+    from yaml import CFullLoader as _BaseLoader
+except ImportError:  # pragma: no cover
+    from yaml import FullLoader as _BaseLoader  # type: ignore
 
-class ConfigFileLoader(yaml.FullLoader):  # pylint: disable=too-many-ancestors
-    """Our YAML loader class, which comes with an attached logger."""
+
+class ConfigFileLoader(_BaseLoader):  # pylint: disable=too-many-ancestors
+    """Our YAML loader class, which comes with an attached logger.
+
+    Attributes:
+        logger: The logger, which is used to report missing variables.
+        environ: A snapshot of the environment variables taken when the loader
+            was created.
+    """
     logger: Logger
+    environ: dict[str, str]
 
     def __init__(self, stream, logger: Logger) -> None:
         super().__init__(stream)
         self.logger = logger
-        self.add_constructor('!env_var', ConfigFileLoader._env_var_constructor)
+        self.environ = os.environ.copy()
+        self._env_var_cache: dict[str, str] = {}
 
     @staticmethod
     def _env_var_constructor(loader: ConfigFileLoader, node: yaml.nodes.Node) -> str:
         """Load environment variables and embed them into the configuration YAML."""
         value = str(node.value)
-        try:
-            env, default = value.split(maxsplit=1)
-        except ValueError:
-            env, default = value, None
-
-        if env in os.environ:
-            return os.environ[env]
-        if default:
+        cached = loader._env_var_cache.get(value)  # pylint: disable=protected-access
+        if cached is not None:
+            return cached
+
+        env, *rest = value.split(maxsplit=1) or [value]
+        default = rest[0] if rest else ''
+        if env in loader.environ:
+            result = loader.environ[env]
+        elif default:
             loader.logger.warning(
                 'Environment variable %s not defined, using default value: %s',
                 env, default)
-            return default
-        loader.logger.critical(
-            'Environment variable %s not defined and no default value provided', env)
-        raise SystemExit(1)
+            result = default
+        else:
+            loader.logger.critical(
+                'Environment variable %s not defined and no default value provided',
+                env)
+            raise SystemExit(1)
+        loader._env_var_cache[value] = result  # pylint: disable=protected-access
+        return result
+
+
+ConfigFileLoader.add_constructor(
+    '!env_var',
+    ConfigFileLoader._env_var_constructor)  # pylint: disable=protected-access
 
 
 class TLSMode(Enum):
@@ -70,6 +92,10 @@ class MailriseConfig(NamedTuple):
         tls_certfile: The path to the TLS certificate chain file.
         tls_keyfile: The path to the TLS key file.
         smtp_hostname: The advertised SMTP server hostname.
+        smtp_max_attachments: The maximum number of attachments to pass on from
+            each email. If None, there is no limit.
+        notify_workers: The number of threads that send notifications. If None,
+            use the Python default.
         senders: A list of notification targets, each with a [key, sender]
             tuple, where key contains username and domain patterns that can be
             matched by fnmatch and sender is the Sender instance itself.
@@ -81,6 +107,8 @@ class MailriseConfig(NamedTuple):
     tls_certfile: typ.Optional[str]
     tls_keyfile: typ.Optional[str]
     smtp_hostname: typ.Optional[str]
+    smtp_max_attachments: typ.Optional[int]
+    notify_workers: typ.Optional[int]
     router: Router
     authenticator: typ.Optional[AuthenticatorType]
 
@@ -98,18 +126,19 @@ class MailriseImportedCode(NamedTuple):
     authenticator: typ.Optional[AuthenticatorType] = None
 
 
-def load_config(logger: Logger, file: io.TextIOWrapper) -> MailriseConfig:
+def load_config(logger: Logger,
+                file: typ.Union[typ.BinaryIO, typ.TextIO]) -> MailriseConfig:
     """Loads configuration data from a YAML file.
 
     Args:
         logger: The logger, which will be passed to the `MailriseConfig` instance.
-        file: The file handle to load YAML from.
+        file: The file handle to load YAML from. Binary file handles are
+            preferred, since libyaml can decode them itself.
 
     Returns:
         The `MailriseConfig` instance.
     """
-    yml = yaml.load(
-        file, Loader=partial(ConfigFileLoader, logger=logger))  # type: ignore
+    yml = _load_yaml(file, logger)
     if not isinstance(yml, dict):
         logger.critical('YAML root node is not a mapping')
         raise SystemExit(1)
@@ -157,12 +186,37 @@ def load_config(logger: Logger, file: io.TextIOWrapper) -> MailriseConfig:
         tls_certfile=tls_certfile,
         tls_keyfile=tls_keyfile,
         smtp_hostname=yml_smtp.get('hostname', None),
+        smtp_max_attachments=_load_count(logger, yml_smtp, 'max_attachments', 0),
+        notify_workers=_load_count(logger, yml.get('notify', {}), 'workers', 1),
         router=router,
         authenticator=authenticator
     )
 
 
+def _load_yaml(file: typ.Union[typ.BinaryIO, typ.TextIO], logger: Logger) -> typ.Any:
+    """Parses a YAML document with our custom loader."""
+    loader = ConfigFileLoader(file, logger)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+def _load_count(logger: Logger, yml: dict[str, typ.Any], key: str,
+                minimum: int) -> typ.Optional[int]:
+    """Reads and validates an optional integer setting with a lower bound."""
+    value = yml.get(key, None)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool)
+                              or value < minimum):
+        logger.critical('Invalid value for %s: %s', key, value)
+        raise SystemExit(1)
+    return value
+
+
 def _load_imported_code(logger: Logger, file_path: str) -> MailriseImportedCode:
+    # Only needed when import_code is set.
+    import importlib.util  # pylint: disable=import-outside-toplevel
+
     spec = importlib.util.spec_from_file_location(os.path.basename(file_path), file_path)
     if not (spec and spec.loader):
         logger.critical(
@@ -181,7 +235,7 @@ def _load_imported_code(logger: Logger, file_path: str) -> MailriseImportedCode:
 
 def _load_authenticator(config: dict[str, typ.Any]) -> typ.Optional[AuthenticatorType]:
     if 'basic' in config and isinstance(config['basic'], dict):
-        logins = {str(username): str(password)
+        logins = {str(username).encode('utf-8'): str(password).encode('utf-8')
                   for username, password in config['basic'].items()}
         return typ.cast(AuthenticatorType, BasicAuthenticator(logins=logins))
 
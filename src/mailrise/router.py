@@ -12,6 +12,8 @@ from apprise import AppriseAsset, NotifyFormat
 from apprise.common import NotifyType
 
 
+_ASSET_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'asset'))
+
 DEFAULT_ASSET = AppriseAsset(
     app_id='Mailrise',
     app_desc='Mailrise SMTP Notification Relay',
@@ -28,13 +30,7 @@ DEFAULT_ASSET = AppriseAsset(
                    'src/mailrise/asset/mailrise-{TYPE}-{XY}{EXTENSION}',
     image_url_logo='https://raw.githubusercontent.com/YoRyan/mailrise/main/'
                    'src/mailrise/asset/mailrise-logo.png',
-    image_path_mask=os.path.abspath(
-        os.path.join(
-            os.path.dirname(__file__),
-            'asset',
-            'mailrise-{TYPE}-{XY}{EXTENSION}'
-        )
-    )
+    image_path_mask=os.path.join(_ASSET_DIR, 'mailrise-{TYPE}-{XY}{EXTENSION}')
 )
 
 
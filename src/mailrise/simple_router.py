@@ -3,10 +3,12 @@ This is the YAML-based router for Mailrise.
 """
 
 from email.utils import parseaddr
-from fnmatch import fnmatchcase
+from fnmatch import translate
+from functools import lru_cache
 from logging import Logger
 from string import Template
 import re
+import sys
 import typing as typ
 
 import apprise
@@ -14,6 +16,35 @@ import yaml
 
 from mailrise.router import AppriseNotification, EmailMessage, Router
 
+# Apprise only accepts configuration files as text, so each sender's node has to
+# be serialized back into YAML; do that with libyaml's emitter when available.
+try:
+    from yaml import CSafeDumper as _Dumper
+except ImportError:  # pragma: no cover
+    from yaml import SafeDumper as _Dumper  # type: ignore
+
+_DEFAULT_DOMAIN = sys.intern('mailrise.xyz')
+
+_NOTIFY_TYPES = {
+    'info': apprise.NotifyType.INFO,
+    'success': apprise.NotifyType.SUCCESS,
+    'warning': apprise.NotifyType.WARNING,
+    'failure': apprise.NotifyType.FAILURE
+}
+# Characters that make email.utils.parseaddr() rewrite an address.
+_ADDRESS_SPECIALS = frozenset('()<>[]:;\\,"@ ')
+_ADDRESS = re.compile(r'(?:"([^"@]*)"|([^@]*))@([^@]*)$')
+
+# A URL that Apprise's TEXT configuration parser will read verbatim, i.e., one
+# that can't be mistaken for a comment, tag assignment, or include directive.
+_PLAIN_URL = re.compile(r'[a-z0-9]{1,12}://[^\r\n]*', re.IGNORECASE)
+
+_KEY_IDENTIFIERS = frozenset(('to', 'config'))
+
+_BODY_FORMATS = frozenset((apprise.NotifyFormat.TEXT,
+                           apprise.NotifyFormat.HTML,
+                           apprise.NotifyFormat.MARKDOWN))
+
 
 class _Key(typ.NamedTuple):
     """A unique identifier for a sender target.
@@ -24,14 +55,14 @@ class _Key(typ.NamedTuple):
             to "mailrise.xyz".
     """
     user: str
-    domain: str = 'mailrise.xyz'
+    domain: str = _DEFAULT_DOMAIN
 
     def __str__(self) -> str:
         return f'{self.user}@{self.domain}'
 
     def as_configured(self) -> str:
         """Drop the domain part of this identifier if it is 'mailrise.xyz'."""
-        return self.user if self.domain == 'mailrise.xyz' else str(self)
+        return self.user if self.domain == _DEFAULT_DOMAIN else str(self)
 
 
 class _Recipient(typ.NamedTuple):
@@ -45,31 +76,50 @@ class _Recipient(typ.NamedTuple):
     notify_type: apprise.NotifyType
 
 
+def _lower_domain(domain: str) -> str:
+    """Lowercases the domain part of an address. Most domains are already
+    lowercase, in which case the copy made by str.lower() is skipped."""
+    return domain if domain.islower() else domain.lower()
+
+
+def _normalize_domain(domain: str) -> str:
+    """Lowercases and interns the domain part of a configured address."""
+    return sys.intern(_lower_domain(domain))
+
+
+@lru_cache(maxsize=1024)
 def _parsercpt(addr: str) -> _Recipient:
-    _, rcpt = parseaddr(addr)
-    user, domain = _parseaddrparts(rcpt)
+    """Parses a recipient address. Alerting setups tend to send to the same few
+    addresses over and over, so the results are cached."""
+    user, at_sign, domain = addr.partition('@')
+    if not (at_sign and domain and addr.isascii() and addr.isprintable()
+            and _ADDRESS_SPECIALS.isdisjoint(user)
+            and _ADDRESS_SPECIALS.isdisjoint(domain)):
+        # Only run the full RFC 5322 parser on addresses that aren't already
+        # bare, which is what aiosmtpd passes in for RCPT TO.
+        _, rcpt = parseaddr(addr)
+        user, domain = _parseaddrparts(rcpt)
     if not user or not domain:
         raise ValueError
-    match = re.search(
-        r'(.*)\.(info|success|warning|failure)$', user, re.IGNORECASE)
     ntype = apprise.NotifyType.INFO
-    if match is not None:
-        user = match.group(1)
-        ntypes = match.group(2)
-        if ntypes == 'info':
-            pass
-        elif ntypes == 'success':
-            ntype = apprise.NotifyType.SUCCESS
-        elif ntypes == 'warning':
-            ntype = apprise.NotifyType.WARNING
-        elif ntypes == 'failure':
-            ntype = apprise.NotifyType.FAILURE
-    return _Recipient(key=_Key(user=user, domain=domain.lower()), notify_type=ntype)
+    head, dot, suffix = user.rpartition('.')
+    if dot:
+        suffix_ntype = _NOTIFY_TYPES.get(suffix.lower())
+        if suffix_ntype is not None:
+            user, ntype = head, suffix_ntype
+    # Recipients come from untrusted clients, so they must not be interned;
+    # interned strings are never freed on newer versions of Python.
+    return _Recipient(key=_Key(user=user, domain=_lower_domain(domain)),
+                      notify_type=ntype)
 
 
 def _parseaddrparts(email: str) -> typ.Tuple[str, str]:
     """Parses an email address into its component user and domain parts."""
-    match = re.search(r'(?:"([^"@]*)"|([^@]*))@([^@]*)$', email)
+    if '"' not in email:
+        # Fast path for the usual unquoted address.
+        head, at_sign, domain = email.rpartition('@')
+        return (head.rpartition('@')[2], domain) if at_sign else ('', '')
+    match = _ADDRESS.search(email)
     if match is None:
         return '', ''
     quoted = match.group(1) is not None
@@ -78,25 +128,95 @@ def _parseaddrparts(email: str) -> typ.Tuple[str, str]:
     return user, domain
 
 
+class _Template(Template):
+    """A string template that is parsed once, when it is created, into literal
+    text and placeholders, so that substituting it is a simple join.
+
+    Attributes:
+        identifiers: The names of the placeholders used by this template.
+    """
+    identifiers: typ.FrozenSet[str]
+
+    def __init__(self, template: str) -> None:
+        super().__init__(template)
+        # Each segment is either literal text (with an identifier of None) or a
+        # placeholder, whose text is kept in case the identifier is missing.
+        segments: typ.List[typ.Tuple[str, typ.Optional[str]]] = []
+        literal = ''
+        pos = 0
+        for match in self.pattern.finditer(template):
+            literal += template[pos:match.start()]
+            pos = match.end()
+            identifier = match.group('named') or match.group('braced')
+            if identifier is not None:
+                if literal:
+                    segments.append((literal, None))
+                    literal = ''
+                segments.append((match.group(), identifier))
+            elif match.group('escaped') is not None:
+                literal += self.delimiter
+            else:
+                literal += match.group()
+        literal += template[pos:]
+        if literal:
+            segments.append((literal, None))
+        self._segments = segments
+        self.identifiers = \
+            frozenset(identifier for _, identifier in segments if identifier)
+        # Templates without any placeholders always render to the same text.
+        self._static = None if self.identifiers \
+            else ''.join(text for text, _ in segments)
+
+    def safe_substitute(self, mapping: typ.Optional[typ.Mapping[str, typ.Any]] = None,
+                        /, **kws: typ.Any) -> str:
+        if self._static is not None:
+            return self._static
+        if mapping is None:
+            mapping = kws
+        elif kws:
+            mapping = {**mapping, **kws}
+        return ''.join([text if identifier is None or identifier not in mapping
+                        else str(mapping[identifier])
+                        for text, identifier in self._segments])
+
+
 class _SimpleSender(typ.NamedTuple):
     """A configured target for Apprise notifications.
 
     Attributes:
-        config_yaml: The YAML configuration for Apprise.
+        config: The configuration file for Apprise.
+        config_format: The format of the configuration file.
         title_template: The template string for notification title texts.
         body_template: The template string for notification body texts.
         body_format: The content type for notifications. If None, this will be
             auto-detected from the body parts of emails.
     """
-    config_yaml: str
-    title_template: Template
-    body_template: Template
+    config: str
+    config_format: typ.Literal['text', 'yaml']
+    title_template: _Template
+    body_template: _Template
     body_format: typ.Optional[apprise.NotifyFormat]
 
 
+def _isglob(pattern: str) -> bool:
+    """Tests whether a pattern contains any fnmatch wildcard tokens."""
+    return any(c in pattern for c in '*?[')
+
+
+def _translate(pattern: str) -> str:
+    """Translates an fnmatch pattern into a regular expression that can be
+    embedded into a larger expression, i.e., without the end anchor."""
+    regex = translate(pattern)
+    return regex[:-2] if regex.endswith(('\\Z', '\\z')) else regex
+
+
 class SimpleRouter(Router):  # pylint: disable=too-few-public-methods
     """A router that uses the rules in the YAML configuration file.
 
+    Senders whose keys contain no wildcards are indexed in a dictionary. The
+    remaining patterns are compiled into a single regular expression, with one
+    named group per sender, so that a lookup never has to scan the whole list.
+
     Attributes:
         senders: A list of notification targets, each with a [key, sender]
             tuple, where key contains username and domain patterns that can be
@@ -108,15 +228,34 @@ class SimpleRouter(Router):  # pylint: disable=too-few-public-methods
         super().__init__()
         self.senders = senders
 
+        self._targets = [sender for _, sender in senders]
+        self._exact: typ.Dict[_Key, int] = {}
+        self._first_glob = len(senders)
+        globs: typ.List[str] = []
+        for index, (key, _) in enumerate(senders):
+            if _isglob(key.user) or _isglob(key.domain):
+                self._first_glob = min(self._first_glob, index)
+                globs.append(
+                    f'(?P<s{index}>{_translate(key.user)}@{_translate(key.domain)})')
+            else:
+                self._exact.setdefault(key, index)
+        self._globs = re.compile('|'.join(globs)) if globs else None
+
     async def email_to_apprise(
         self, logger: Logger, email: EmailMessage, auth_data: typ.Any, **kwargs) \
             -> typ.AsyncGenerator[AppriseNotification, None]:
+        seen: typ.Set[_Recipient] = set()
         for addr in email.to:
             try:
                 rcpt = _parsercpt(addr)
             except ValueError:
                 logger.error('Not a valid Mailrise address: %s', addr)
                 continue
+            # Addresses that differ only in case or formatting would produce
+            # identical notifications, so send each one only once.
+            if rcpt in seen:
+                continue
+            seen.add(rcpt)
             sender = self.get_sender(rcpt.key)
             if sender is None:
                 logger.error('Recipient is not configured: %s', addr)
@@ -126,13 +265,16 @@ class SimpleRouter(Router):  # pylint: disable=too-few-public-methods
                 'subject': email.subject,
                 'from': email.from_,
                 'body': email.body,
-                'to': str(rcpt.key),
-                'config': rcpt.key.as_configured(),
                 'type': rcpt.notify_type
             }
+            # Only format the recipient strings if the templates use them.
+            if not (_KEY_IDENTIFIERS.isdisjoint(sender.title_template.identifiers)
+                    and _KEY_IDENTIFIERS.isdisjoint(sender.body_template.identifiers)):
+                mapping['to'] = str(rcpt.key)
+                mapping['config'] = rcpt.key.as_configured()
             yield AppriseNotification(
-                config=sender.config_yaml,
-                config_format='yaml',
+                config=sender.config,
+                config_format=sender.config_format,
                 title=sender.title_template.safe_substitute(mapping),
                 body=sender.body_template.safe_substitute(mapping),
                 # Use the configuration body format if specified.
@@ -142,11 +284,19 @@ class SimpleRouter(Router):  # pylint: disable=too-few-public-methods
             )
 
     def get_sender(self, key: _Key) -> _SimpleSender | None:
-        """Find a sender by recipient key."""
-        return next(
-            (sender for (pattern_key, sender) in self.senders
-             if fnmatchcase(key.user, pattern_key.user)
-             and fnmatchcase(key.domain, pattern_key.domain)), None)
+        """Find a sender by recipient key. If multiple patterns match, the first
+        one in the configuration wins."""
+        targets = self._targets
+        index = self._exact.get(key, len(targets))
+        globs = self._globs
+        if index > self._first_glob and globs is not None:
+            user, domain = key
+            # Neither user nor domain can contain an "@", so it is safe to use
+            # as a separator.
+            match = globs.fullmatch(f'{user}@{domain}')
+            if match is not None and match.lastgroup is not None:
+                index = min(index, int(match.lastgroup[1:]))
+        return targets[index] if index < len(targets) else None
 
 
 def load_from_yaml(logger: Logger, configs_node: dict[str, typ.Any]) -> SimpleRouter:
@@ -169,17 +319,25 @@ def _parse_simple_key(logger: Logger, key: str) -> _Key:
     def fatal():
         logger.critical(
             "Invalid config key '%s'; should be a string or an email address "
-            'without periods in the username')
+            'without periods in the username', key)
         raise SystemExit(1)
-    if '@' in key:
-        user, domain = _parseaddrparts(key)
-        if not user or not domain or '.' in user:
+    user, at_sign, domain = key.rpartition('@')
+    if not at_sign:
+        if '.' in key:
             fatal()
-        return _Key(user=user, domain=domain.lower())
-    if '.' in key:
+        return _Key(user=sys.intern(key))
+    if user.startswith('"'):
+        user, domain = _parseaddrparts(key)
+    if not user or not domain or '.' in user or '@' in user:
         fatal()
+    return _Key(user=sys.intern(user), domain=_normalize_domain(domain))
+
 
-    return _Key(user=key)
+@lru_cache(maxsize=256)
+def _template(template: str) -> _Template:
+    """Creates a template, sharing instances among senders with the same
+    template string (which is usually one of the defaults)."""
+    return _Template(template)
 
 
 def _load_simple_sender(logger: Logger, key: str, config: dict[str, typ.Any]) -> _SimpleSender:
@@ -193,16 +351,30 @@ def _load_simple_sender(logger: Logger, key: str, config: dict[str, typ.Any]) ->
     title_template = mr_config.get('title_template', '$subject ($from)')
     body_template = mr_config.get('body_template', '$body')
     body_format = mr_config.get('body_format', None)
-    if not any(body_format == c for c in (None,
-                                          apprise.NotifyFormat.TEXT,
-                                          apprise.NotifyFormat.HTML,
-                                          apprise.NotifyFormat.MARKDOWN)):
+    if body_format is not None \
+            and not (isinstance(body_format, str) and body_format in _BODY_FORMATS):
         logger.critical('Invalid Apprise notification format: %s', body_format)
         raise SystemExit(1)
+    for name, template in (('title', title_template), ('body', body_template)):
+        if not isinstance(template, str):
+            logger.critical('Invalid %s template: %s', name, template)
+            raise SystemExit(1)
+
+    # A plain list of URLs, which is the most common configuration, doesn't need
+    # to go through YAML at all; Apprise's TEXT format is one URL per line.
+    urls = config.get('urls')
+    if config.keys() == {'urls'} and isinstance(urls, list) and urls \
+            and all(isinstance(url, str) and _PLAIN_URL.fullmatch(url) for url in urls):
+        apprise_config = '\n'.join(urls)
+        config_format: typ.Literal['text', 'yaml'] = 'text'
+    else:
+        apprise_config = yaml.dump(config, Dumper=_Dumper)
+        config_format = 'yaml'
 
     return _SimpleSender(
-        config_yaml=yaml.safe_dump(config),
-        title_template=Template(title_template),
-        body_template=Template(body_template),
-        body_format=body_format
+        config=apprise_config,
+        config_format=config_format,
+        title_template=_template(title_template),
+        body_template=_template(body_template),
+        body_format=typ.cast(typ.Optional[apprise.NotifyFormat], body_format)
     )
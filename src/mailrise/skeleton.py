@@ -11,6 +11,7 @@ import ssl
 import sys
 import typing as typ
 from asyncio.events import new_event_loop
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from aiosmtpd.controller import UnthreadedController, SMTP
@@ -19,6 +20,12 @@ from mailrise import __version__
 from mailrise.config import TLSMode, load_config
 from mailrise.smtp import AppriseHandler
 
+# uvloop is an optional, faster drop-in replacement for the asyncio event loop.
+try:
+    import uvloop  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover
+    uvloop = None  # type: ignore
+
 __author__ = "Ryan Young"
 __copyright__ = "Ryan Young"
 __license__ = "MIT"
@@ -59,7 +66,7 @@ def parse_args(args: list[str]) -> argparse.Namespace:
     parser.add_argument(
         dest="config",
         help="path to configuration file",
-        type=argparse.FileType("r"),
+        type=argparse.FileType("rb"),
         metavar="CONFIG"
     )
     parser.add_argument(
@@ -123,7 +130,8 @@ def main(args: list[str]) -> None:
 
     makecon = partial(
         UnthreadedController,
-        AppriseHandler(config=config),
+        AppriseHandler(config=config, notify_executor=ThreadPoolExecutor(
+            max_workers=config.notify_workers, thread_name_prefix='mailrise-notify')),
         authenticator=config.authenticator,
         auth_required=config.authenticator is not None,
         # We assume that if you've enabled STARTTLS, you'll want to require it.
@@ -143,7 +151,7 @@ def main(args: list[str]) -> None:
                   for kw in ('authenticator', 'auth_required', 'auth_require_tls',
                              'tls_context', 'ssl_context', 'require_starttls')))
 
-    eloop = new_event_loop()
+    eloop = new_event_loop() if uvloop is None else uvloop.new_event_loop()
     controller = makecon(loop=eloop)
 
     def clean_exit():
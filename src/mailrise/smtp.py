@@ -8,10 +8,14 @@ import asyncio
 import email.policy
 import os
 import typing as typ
+from concurrent.futures import Executor
 from email import contentmanager
 from email.message import EmailMessage as StdlibEmailMessage
-from email.parser import BytesParser
-from tempfile import NamedTemporaryFile
+from email.parser import BytesFeedParser
+from functools import lru_cache
+from itertools import islice
+from logging import Logger
+from tempfile import mkstemp
 
 import apprise
 from aiosmtpd.smtp import Envelope, Session, SMTP
@@ -28,6 +32,9 @@ if MYPY:
 else:
     from apprise.attachment import AttachBase
 
+# Incoming messages are fed to the parser in chunks of this size.
+_FEED_CHUNK = 2**16
+
 
 class AppriseNotifyFailure(Exception):
     """Exception raised when Apprise fails to deliver a notification.
@@ -43,11 +50,17 @@ class UnreadableMultipart(Exception):
     Attributes:
         message: The multipart email part.
     """
-    message: StdlibEmailMessage
 
     def __init__(self, message: StdlibEmailMessage) -> None:
-        super().__init__(self)
-        self.message = message
+        super().__init__(message)
+
+    @property
+    def message(self) -> StdlibEmailMessage:
+        """The multipart email part."""
+        return self.args[0]
+
+    def __str__(self) -> str:
+        return f'unreadable {self.message.get_content_type()} message'
 
 
 class AppriseHandler(typ.NamedTuple):
@@ -55,8 +68,11 @@ class AppriseHandler(typ.NamedTuple):
 
     Attributes:
         config: This server's Mailrise configuration.
+        notify_executor: The executor that sends Apprise notifications. If None,
+            the event loop's default executor is used.
     """
     config: MailriseConfig
+    notify_executor: typ.Optional[Executor] = None
 
     # pylint: disable=invalid-name,unused-argument,too-many-arguments
     async def handle_RCPT(self, server: SMTP, session: Session, envelope: Envelope,
@@ -72,16 +88,12 @@ class AppriseHandler(typ.NamedTuple):
         """Called during DATA after the entire message ('SMTP content' as described
         in RFC 5321) has been received."""
         assert isinstance(envelope.content, bytes)
-        parser = BytesParser(policy=email.policy.default)
-        message = parser.parsebytes(envelope.content)
-        assert isinstance(message, StdlibEmailMessage)
-        try:
-            notification = _parsemessage(message, envelope)
-        except UnreadableMultipart as mpe:
-            subparts = \
-                ' '.join(part.get_content_type() for part in mpe.message.iter_parts())
-            self.config.logger.error('Failed to parse %s message: [ %s ]',
-                                     mpe.message.get_content_type(), subparts)
+        # Parsing (and decoding attachments) is CPU-bound work, so keep it off
+        # the event loop to avoid stalling other SMTP sessions.
+        loop = asyncio.get_running_loop()
+        notification = await loop.run_in_executor(
+            None, _parsecontent, self.config.logger, envelope.content, envelope,
+            self.config.smtp_max_attachments)
         self.config.logger.info('Accepted email: %s', _logmessage(notification))
 
         try:
@@ -93,10 +105,24 @@ class AppriseHandler(typ.NamedTuple):
         except Exception as exc:  # pylint: disable=broad-except
             return f'450 router had internal exception: {exc}'
 
-        results = await asyncio.gather(
-            *(_apprise_notify(self.config, data) for data in to_send),
-            return_exceptions=True
-        )
+        attach_bases: dict[int, _AttachMailrise] = {}
+        try:
+            # Write each attachment to disk once and share it among all notifications.
+            if any(data.attachments for data in to_send):
+                attach_bases = await loop.run_in_executor(
+                    None, _stageattachments, self.config, to_send)
+            results = await asyncio.gather(
+                *(_apprise_notify(data, attach_bases, self.notify_executor)
+                  for data in to_send),
+                return_exceptions=True
+            )
+        except OSError as exc:
+            self.config.logger.error('Failed to stage attachments: %s', exc)
+            return f'450 failed to stage attachments: {exc}'
+        finally:
+            # NOTE: This should probably be called by Apprise itself, but it isn't?
+            for base in attach_bases.values():
+                base.invalidate()
         if any(isinstance(result, AppriseNotifyFailure) for result in results):
             self.config.logger.warning('Notification failed: %s', _logmessage(notification))
             return '450 failed to send notification'
@@ -104,40 +130,73 @@ class AppriseHandler(typ.NamedTuple):
         return '250 OK'
 
 
-def _parsemessage(msg: StdlibEmailMessage, envelope: Envelope) -> r.EmailMessage:
-    """Parses an email message into an `EmailNotification`.
+def _parsecontent(logger: Logger, content: bytes, envelope: Envelope,
+                  max_attachments: typ.Optional[int] = None) -> r.EmailMessage:
+    """Parses the raw contents of an SMTP message into an `EmailNotification`."""
+    # BytesParser.parsebytes() decodes the whole message into one string and
+    # then copies it again into a StringIO. Feeding it in chunks avoids both of
+    # those copies, which matters for messages with large attachments.
+    parser = BytesFeedParser(policy=email.policy.default)
+    for start in range(0, len(content), _FEED_CHUNK):
+        parser.feed(content[start:start + _FEED_CHUNK])
+    message = parser.close()
+    assert isinstance(message, StdlibEmailMessage)
+    return _parsemessage(logger, message, envelope, max_attachments)
+
+
+def _parsemessage(logger: Logger, msg: StdlibEmailMessage, envelope: Envelope,
+                  max_attachments: typ.Optional[int] = None) -> r.EmailMessage:
+    """Parses an email message into an `EmailNotification`. If the body of the
+    message can't be read, the notification is sent without one.
 
     Args:
+        logger: The logger to report unreadable messages to.
         msg: The email message.
+        max_attachments: The maximum number of attachments to decode. Any
+            others are dropped, and a note is added to the body.
 
     Returns:
         The `EmailNotification` instance.
     """
     py_body_part = msg.get_body()
-    body: typ.Optional[tuple[str, apprise.NotifyFormat]]
+    body: typ.Optional[tuple[str, apprise.NotifyFormat]] = None
     if isinstance(py_body_part, StdlibEmailMessage):
-        body_part: StdlibEmailMessage
+        body_part: typ.Optional[StdlibEmailMessage]
         try:
             py_body_part.get_content()
         except KeyError:  # stdlib failed to read the content, which means multipart
-            body_part = _getmultiparttext(py_body_part)
+            try:
+                body_part = _getmultiparttext(py_body_part)
+            except UnreadableMultipart as mpe:
+                subparts = ' '.join(
+                    part.get_content_type() for part in mpe.message.iter_parts())
+                logger.error('Failed to parse %s message: [ %s ]',
+                             mpe.message.get_content_type(), subparts)
+                body_part = None
         else:
             body_part = py_body_part
-        body_content = contentmanager.raw_data_manager.get_content(body_part)
-        is_html = body_part.get_content_subtype() == 'html'
-        body = (body_content.strip(),
-                apprise.NotifyFormat.HTML if is_html else apprise.NotifyFormat.TEXT)
-    else:
-        body = None
-    attachments = [_parseattachment(part) for part in msg.iter_attachments()
-                   if isinstance(part, StdlibEmailMessage)]
+        if body_part is not None:
+            body_content = contentmanager.raw_data_manager.get_content(body_part)
+            is_html = body_part.get_content_subtype() == 'html'
+            body = (body_content.strip(),
+                    apprise.NotifyFormat.HTML if is_html else apprise.NotifyFormat.TEXT)
+    parts = (part for part in msg.iter_attachments()
+             if isinstance(part, StdlibEmailMessage))
+    attachments = [_parseattachment(part) for part in islice(parts, max_attachments)]
+    # Count, but don't decode, whatever is left over.
+    dropped = sum(1 for _ in parts)
+    # Apprise will fail if no body is supplied.
+    body_text = body[0] if body else '[no body]'
+    if dropped:
+        logger.warning('Dropped %d attachment(s) over the limit of %d',
+                       dropped, max_attachments)
+        body_text += f'\n\n[{dropped} attachment(s) dropped]'
     return r.EmailMessage(
         email_message=msg,
         subject=msg.get('Subject', '[no subject]'),
         from_=msg.get('From', '[no sender]'),
         to=envelope.rcpt_tos,
-        # Apprise will fail if no body is supplied.
-        body=body[0] if body else '[no body]',
+        body=body_text,
         body_format=body[1] if body else apprise.NotifyFormat.TEXT,
         attachments=attachments
     )
@@ -147,13 +206,15 @@ def _getmultiparttext(msg: StdlibEmailMessage) -> StdlibEmailMessage:
     """Search for the textual body part of a multipart email."""
     content_type = msg.get_content_type()
     if content_type in ('multipart/related', 'multipart/alternative'):
-        parts = list(msg.iter_parts())
+        # Index the first part of each content type in a single pass.
+        parts: dict[str, StdlibEmailMessage] = {}
+        for part in msg.iter_parts():
+            if isinstance(part, StdlibEmailMessage):
+                parts.setdefault(part.get_content_type(), part)
         # Look for these types of parts in descending order.
         for parttype in ('multipart/alternative', 'multipart/related',
                          'text/html', 'text/plain'):
-            found = \
-                next((p for p in parts if isinstance(p, StdlibEmailMessage)
-                     and p.get_content_type() == parttype), None)
+            found = parts.get(parttype)
             if found is not None:
                 return _getmultiparttext(found)
         raise UnreadableMultipart(msg)
@@ -176,22 +237,75 @@ def _logmessage(msg: r.EmailMessage) -> str:
     return f'address: [ {addresses} ] subject: [ {subject} ] body: [ {body} ]{attachments_field}'
 
 
-async def _apprise_notify(config: MailriseConfig, data: r.AppriseNotification):
-    ap_config = apprise.AppriseConfig(asset=data.asset or r.DEFAULT_ASSET)
-    ap_config.add_config(data.config, format=data.config_format)
+@lru_cache(maxsize=256)
+def _apprise_instance(config: str, config_format: typ.Literal['text', 'yaml'] | None,
+                      asset: apprise.AppriseAsset) -> apprise.Apprise:
+    """Build an Apprise instance for a configuration file.
+
+    Apprise parses the configuration once and keeps the resulting services, so
+    instances are cached by their configuration text to avoid re-parsing it for
+    every notification sent to the same target.
+
+    Cached instances are shared by concurrent sends on the notify executor.
+    Apprise fills in a configuration's service list lazily, starting from an
+    empty list, so the configuration is parsed here, before the instance is
+    published; after that, sends only read it. This assumes, as Apprise's own
+    async_notify() does, that a service plugin can be used from several
+    threads at once.
+    """
+    ap_config = apprise.AppriseConfig(asset=asset)
+    ap_config.add_config(config, format=config_format)
     ap_instance = apprise.Apprise(ap_config)
+    len(ap_instance)  # Parses the configuration.
+    return ap_instance
 
-    attach_base = [_AttachMailrise(config, attach) for attach in data.attachments]
-    success = await ap_instance.async_notify(
-        title=data.title,
-        body=data.body,
-        body_format=data.body_format,
-        notify_type=data.notify_type,
-        attach=attach_base
-    )
-    # NOTE: This should probably be called by Apprise itself, but it isn't?
-    for base in attach_base:
-        base.invalidate()
+
+def _stageattachments(config: MailriseConfig,
+                      to_send: typ.Iterable[r.AppriseNotification]) \
+        -> dict[int, _AttachMailrise]:
+    """Writes out the attachments of a batch of notifications to temporary
+    files, once per distinct attachment. If any of them can't be written, the
+    ones that were are removed again.
+
+    Returns:
+        The staged Apprise attachments, keyed by the `id()` of the attachment.
+    """
+    attach_bases: dict[int, _AttachMailrise] = {}
+    try:
+        for data in to_send:
+            for attach in data.attachments:
+                if id(attach) not in attach_bases:
+                    base = _AttachMailrise(config, attach)
+                    base.download()
+                    attach_bases[id(attach)] = base
+    except BaseException:
+        for base in attach_bases.values():
+            base.invalidate()
+        raise
+    return attach_bases
+
+
+async def _apprise_notify(data: r.AppriseNotification,
+                          attach_bases: typ.Mapping[int, _AttachMailrise],
+                          executor: typ.Optional[Executor] = None):
+    ap_instance = _apprise_instance(
+        data.config, data.config_format, data.asset or r.DEFAULT_ASSET)
+
+    # Apprise's own async_notify() always sends from the loop's default
+    # executor, which is also used to parse incoming mail. Run the blocking API
+    # on our executor instead, so slow services can't hold up parsing.
+    def send() -> bool:
+        return ap_instance.notify(
+            title=data.title,
+            body=data.body,
+            body_format=data.body_format,
+            notify_type=data.notify_type,
+            # Apprise wraps any list, even an empty one, in an AppriseAttachment.
+            attach=[attach_bases[id(attach)] for attach in data.attachments]
+            if data.attachments else None
+        )
+
+    success = await asyncio.get_running_loop().run_in_executor(executor, send)
     if not success:
         raise AppriseNotifyFailure
 
@@ -199,7 +313,9 @@ async def _apprise_notify(config: MailriseConfig, data: r.AppriseNotification):
 class _AttachMailrise(AttachBase):
     """An Apprise attachment type that wraps `Attachment`.
 
-    Data is stored in temporary files for upload.
+    Data is stored in temporary files for upload. Once written, the file is
+    kept until `invalidate()` is called, so that it can be shared by several
+    notifications sending in parallel.
 
     Args:
         config: The Mailrise configuration to use.
@@ -207,10 +323,11 @@ class _AttachMailrise(AttachBase):
     """
     location = ContentLocation.LOCAL
 
-    _mrfile = None  # Satisfy mypy by initializing as an Optional.
+    _mrfile: typ.Optional[str] = None
 
     def __init__(self, config: MailriseConfig,
                  attach: r.EmailAttachment, **kwargs: typ.Any) -> None:
+        kwargs.setdefault('cache', True)
         super().__init__(**kwargs)
         self._mrconfig = config
         self._mrattach = attach
@@ -218,22 +335,32 @@ class _AttachMailrise(AttachBase):
     def download(self) -> bool:
         self.invalidate()
 
-        with NamedTemporaryFile(delete=False) as tfile:
-            tfile.write(self._mrattach.data)
-        self._mrfile = tfile
-        self.download_path = tfile.name
+        # Write straight to the file descriptor; a buffered file object would
+        # only add another copy of what may be a large attachment.
+        fd, path = mkstemp(prefix='mailrise-')
+        try:
+            view = memoryview(self._mrattach.data)
+            while view:
+                view = view[os.write(fd, view):]
+        except BaseException:
+            os.close(fd)
+            os.remove(path)
+            raise
+        os.close(fd)
+        self._mrfile = path
+        self.download_path = path
         self.detected_name = self._mrattach.filename
 
         return True  # Indicates the "download" was successful.
 
     def invalidate(self) -> None:
-        tfile = self._mrfile
-        if tfile:
+        path = self._mrfile
+        if path:
             try:
-                os.remove(tfile.name)
+                os.remove(path)
             except (FileNotFoundError, OSError):
                 self._mrconfig.logger.info(
-                    'Failed to delete attachment file: %s', tfile.name)
+                    'Failed to delete attachment file: %s', path)
             self._mrfile = None
         super().invalidate()
 
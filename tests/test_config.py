@@ -3,9 +3,11 @@ Tests for configuration loading.
 """
 
 import logging
-from io import StringIO
+from io import BytesIO, StringIO
+from typing import cast
 
 import pytest
+from aiosmtpd.smtp import Envelope, LoginPassword, Session, SMTP
 from apprise import Apprise, AppriseConfig, NotifyFormat
 from pytest import MonkeyPatch
 
@@ -54,10 +56,41 @@ def test_load() -> None:
 
     sender = router.get_sender(key)
     assert sender is not None
-    notifier = _make_notifier(sender.config_yaml)
+    assert sender.config_format == 'text'
+    notifier = _make_notifier(sender.config, sender.config_format)
     assert len(notifier) == 1
     assert notifier[0].url().startswith('json://localhost/')
 
+    file = StringIO("""
+        configs:
+          test:
+            urls:
+              - json://localhost
+            tag: mytag
+    """)
+    mrise = load_config(_logger, file)
+    router = mrise.router
+    assert isinstance(router, SimpleRouter)
+    sender = router.get_sender(key)
+    assert sender is not None
+    assert sender.config_format == 'yaml'
+    notifier = _make_notifier(sender.config, sender.config_format)
+    assert len(notifier) == 1
+
+
+def test_load_binary() -> None:
+    """Tests a successful load with :fun:`load_config` from a binary file."""
+    file = BytesIO("""
+        configs:
+          tést:
+            urls:
+              - json://localhost
+    """.encode('utf-8'))
+    mrise = load_config(_logger, file)
+    router = mrise.router
+    assert isinstance(router, SimpleRouter)
+    assert router.get_sender(_Key(user='tést')) is not None
+
 
 def test_multi_load() -> None:
     """Tests a sucessful load with :fun:`load_config` with multiple configs."""
@@ -80,7 +113,7 @@ def test_multi_load() -> None:
 
         sender = router.get_sender(key)
         assert sender is not None
-        notifier = _make_notifier(sender.config_yaml)
+        notifier = _make_notifier(sender.config, sender.config_format)
         assert len(notifier) == 1
         assert notifier[0].url().startswith('json://localhost/')
 
@@ -118,6 +151,36 @@ def test_mailrise_options() -> None:
                   body_format: "BAD"
         """)
         load_config(_logger, file)
+    with pytest.raises(SystemExit):
+        file = StringIO("""
+            configs:
+              test:
+                urls:
+                  - json://localhost
+                mailrise:
+                  body_format: ["text"]
+        """)
+        load_config(_logger, file)
+    with pytest.raises(SystemExit):
+        file = StringIO("""
+            configs:
+              test:
+                urls:
+                  - json://localhost
+                mailrise:
+                  title_template: 2024
+        """)
+        load_config(_logger, file)
+    with pytest.raises(SystemExit):
+        file = StringIO("""
+            configs:
+              test:
+                urls:
+                  - json://localhost
+                mailrise:
+                  body_template: ["$body"]
+        """)
+        load_config(_logger, file)
 
 
 def test_config_keys() -> None:
@@ -138,6 +201,14 @@ def test_config_keys() -> None:
                   - json://localhost
         """)
         load_config(_logger, file)
+    with pytest.raises(SystemExit):
+        file = StringIO("""
+            configs:
+              bad@email@example.com:
+                urls:
+                  - json://localhost
+        """)
+        load_config(_logger, file)
     file = StringIO("""
         configs:
           user@example.com:
@@ -213,9 +284,77 @@ def test_authenticator() -> None:
     mrise = load_config(_logger, file)
     assert isinstance(mrise.authenticator, BasicAuthenticator)
     logins = mrise.authenticator.logins
-    assert logins['username'] == 'password'
-    assert logins['AzureDiamond'] == 'hunter2'
-    assert 'test' not in logins
+    assert logins[b'username'] == b'password'
+    assert logins[b'AzureDiamond'] == b'hunter2'
+    assert b'test' not in logins
+
+    def auth(login: bytes, password: bytes) -> bool:
+        assert mrise.authenticator is not None
+        result = mrise.authenticator(
+            cast(SMTP, {}), cast(Session, {}), cast(Envelope, {}), 'PLAIN',
+            LoginPassword(login=login, password=password))
+        return result.success
+
+    assert auth(b'AzureDiamond', b'hunter2')
+    assert not auth(b'AzureDiamond', b'*******')
+    assert not auth(b'nobody', b'hunter2')
+
+
+def test_max_attachments() -> None:
+    """Tests the attachment limit setting."""
+    file = StringIO("""
+        configs:
+          test:
+            urls:
+              - json://localhost
+    """)
+    mrise = load_config(_logger, file)
+    assert mrise.smtp_max_attachments is None
+    file = StringIO("""
+        configs:
+          test:
+            urls:
+              - json://localhost
+        smtp:
+          max_attachments: 5
+    """)
+    mrise = load_config(_logger, file)
+    assert mrise.smtp_max_attachments == 5
+    for bad in ('-1', 'yes', 'many'):
+        with pytest.raises(SystemExit):
+            file = StringIO(f"""
+                configs:
+                  test:
+                    urls:
+                      - json://localhost
+                smtp:
+                  max_attachments: {bad}
+            """)
+            load_config(_logger, file)
+
+
+def test_notify_workers() -> None:
+    """Tests the notification thread count setting."""
+    file = StringIO("""
+        configs:
+          test:
+            urls:
+              - json://localhost
+        notify:
+          workers: 4
+    """)
+    mrise = load_config(_logger, file)
+    assert mrise.notify_workers == 4
+    with pytest.raises(SystemExit):
+        file = StringIO("""
+            configs:
+              test:
+                urls:
+                  - json://localhost
+            notify:
+              workers: 0
+        """)
+        load_config(_logger, file)
 
 
 def test_env_var() -> None:
@@ -235,6 +374,20 @@ def test_env_var() -> None:
                 test:
                   urls:
                     - !env_var fallback json://localhost
+            """),
+            StringIO("""
+              configs:
+                test:
+                  urls:
+                    - !env_var "fallback\tjson://localhost"
+            """),
+            StringIO("""
+              configs:
+                test:
+                  urls:
+                    - !env_var |
+                      fallback
+                      json://localhost
             """)
         ]
         for file in files:
@@ -245,7 +398,7 @@ def test_env_var() -> None:
             key = _Key(user='test')
             sender = router.get_sender(key)
             assert sender is not None
-            notifier = _make_notifier(sender.config_yaml)
+            notifier = _make_notifier(sender.config, sender.config_format)
             # Missing type annotation for this property as of Dec 2022.
             ap_servers = notifier.servers  # type: ignore
             assert len(ap_servers) == 1
@@ -264,7 +417,7 @@ def test_env_var() -> None:
         load_config(_logger, file)
 
 
-def _make_notifier(config: str):
+def _make_notifier(config: str, config_format: str):
     ap_config = AppriseConfig()
-    ap_config.add_config(config, format='yaml')
+    ap_config.add_config(config, format=config_format)
     return Apprise(ap_config)
@@ -2,10 +2,21 @@
 Tests for the YAML-based router.
 """
 
+from __future__ import annotations
+
+import logging
+from email.message import EmailMessage as StdlibEmailMessage
+from string import Template
+
 import apprise
 import pytest
 
-from mailrise.simple_router import _Key, _parsercpt
+from mailrise.router import EmailMessage
+from mailrise.simple_router import (
+    _Key, _parsercpt, _SimpleSender, _Template, SimpleRouter)
+
+
+_logger = logging.getLogger(__name__)
 
 
 def test_parsercpt() -> None:
@@ -14,10 +25,21 @@ def test_parsercpt() -> None:
     assert rcpt.key == _Key(user='test')
     assert rcpt.notify_type == apprise.NotifyType.INFO
 
+    rcpt = _parsercpt('test@Mailrise.XYZ')
+    assert rcpt.key == _Key(user='test')
+
     rcpt = _parsercpt('test.warning@mailrise.xyz')
     assert rcpt.key == _Key(user='test')
     assert rcpt.notify_type == apprise.NotifyType.WARNING
 
+    rcpt = _parsercpt('test.FAILURE@mailrise.xyz')
+    assert rcpt.key == _Key(user='test')
+    assert rcpt.notify_type == apprise.NotifyType.FAILURE
+
+    rcpt = _parsercpt('test.unknown@mailrise.xyz')
+    assert rcpt.key == _Key(user='test.unknown')
+    assert rcpt.notify_type == apprise.NotifyType.INFO
+
     rcpt = _parsercpt('"with_quotes"@mailrise.xyz')
     assert rcpt.key == _Key(user='with_quotes')
     assert rcpt.notify_type == apprise.NotifyType.INFO
@@ -36,3 +58,68 @@ def test_parsercpt() -> None:
 
     with pytest.raises(ValueError):
         _parsercpt("Invalid Email <bad@>")
+
+
+def test_get_sender() -> None:
+    """Tests that sender lookups respect the configured order of patterns."""
+    def sender(name: str) -> _SimpleSender:
+        return _SimpleSender(config=name, config_format='text',
+                             title_template=_Template(''), body_template=_Template(''),
+                             body_format=None)
+
+    router = SimpleRouter(senders=[
+        (_Key(user='exact'), sender('exact')),
+        (_Key(user='ex*'), sender('glob')),
+        (_Key(user='exotic'), sender('shadowed')),
+        (_Key(user='*', domain='*.com'), sender('domain')),
+        (_Key(user='[!x]*', domain='example.org'), sender('set')),
+    ])
+
+    def lookup(user: str, domain: str = 'mailrise.xyz') -> str | None:
+        found = router.get_sender(_Key(user=user, domain=domain))
+        return found.config if found else None
+
+    assert lookup('exact') == 'exact'
+    assert lookup('exotic') == 'glob'
+    assert lookup('other') is None
+    assert lookup('other', 'example.com') == 'domain'
+    assert lookup('exotic', 'example.com') == 'domain'
+    assert lookup('yes', 'example.org') == 'set'
+    assert lookup('xno', 'example.org') is None
+
+
+def test_template() -> None:
+    """Tests that pre-parsed templates substitute like string.Template."""
+    mapping = {'subject': 'Hello', 'from': 'sender@example.com', 'body': '$body'}
+    for template in ('$subject ($from)', '$body', '', 'no placeholders', '$$5 off',
+                     '$$subject ${subject}s $missing ${missing} $ $1 $$$body',
+                     'trailing $'):
+        expected = Template(template).safe_substitute(mapping)
+        assert _Template(template).safe_substitute(mapping) == expected
+        assert _Template(template).safe_substitute(**mapping) == expected
+
+
+@pytest.mark.asyncio
+async def test_email_to_apprise() -> None:
+    """Tests notification rendering for the YAML-based router."""
+    router = SimpleRouter(senders=[
+        (_Key(user='test'), _SimpleSender(
+            config='json://localhost', config_format='text',
+            title_template=_Template('$subject to $to ($config.$type)'),
+            body_template=_Template('$body'), body_format=None)),
+        (_Key(user='static'), _SimpleSender(
+            config='json://localhost', config_format='text',
+            title_template=_Template('Static'),
+            body_template=_Template('$body'), body_format=None)),
+    ])
+    email = EmailMessage(
+        email_message=StdlibEmailMessage(), subject='Hello', from_='sender@example.com',
+        to=['test.warning@mailrise.xyz', 'static@mailrise.xyz', 'nobody@mailrise.xyz',
+            'TEST.WARNING@MAILRISE.XYZ', '"static"@mailrise.xyz'],
+        body='Lorem ipsum', body_format=apprise.NotifyFormat.TEXT, attachments=[])
+    notifications = [n async for n in router.email_to_apprise(_logger, email, None)]
+    assert len(notifications) == 2
+    assert notifications[0].title == 'Hello to test@mailrise.xyz (test.warning)'
+    assert notifications[0].body == 'Lorem ipsum'
+    assert notifications[0].notify_type == apprise.NotifyType.WARNING
+    assert notifications[1].title == 'Static'
@@ -2,13 +2,60 @@
 Tests for the SMTP server functionality.
 """
 
+import asyncio
+import base64
+import email.policy
+import errno
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
+from email.parser import BytesParser
 from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, cast, List, Optional, Tuple
 
 import apprise
-from aiosmtpd.smtp import Envelope
+import pytest
+from aiosmtpd.smtp import Envelope, Session, SMTP
+from apprise.config.ConfigMemory import ConfigMemory
+from apprise.plugins.NotifyJSON import NotifyJSON
 
-from mailrise.smtp import _parsemessage
+import mailrise.smtp
+from mailrise.config import MailriseConfig, TLSMode
+from mailrise.router import AppriseNotification, DEFAULT_ASSET, EmailAttachment, Router
+from mailrise.simple_router import _Key, _SimpleSender, _Template, SimpleRouter
+from mailrise.smtp import (
+    _FEED_CHUNK, _apprise_instance, _apprise_notify, _parsecontent, _parsemessage,
+    _stageattachments, AppriseHandler, AppriseNotifyFailure, UnreadableMultipart)
+
+_logger = logging.getLogger(__name__)
+
+
+def _make_config(router: Optional[Router] = None) -> MailriseConfig:
+    return MailriseConfig(
+        logger=_logger, listen_host='', listen_port=8025,
+        tls_mode=TLSMode.OFF, tls_certfile=None, tls_keyfile=None,
+        smtp_hostname=None, smtp_max_attachments=None, notify_workers=None,
+        router=router, authenticator=None)  # type: ignore
+
+
+def _fail_second_mkstemp(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """Makes the second temporary file fail to be created, as if the disk were
+    full. Returns the paths of the files that were created."""
+    created: List[str] = []
+
+    def mkstemp(*args: Any, **kwargs: Any) -> Tuple[int, str]:
+        if len(created) == 1:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        fd, path = real_mkstemp(*args, **kwargs)
+        created.append(path)
+        return fd, path
+
+    real_mkstemp = mailrise.smtp.mkstemp
+    monkeypatch.setattr(mailrise.smtp, 'mkstemp', mkstemp)
+    return created
 
 
 def test_parsemessage() -> None:
@@ -17,7 +64,7 @@ def test_parsemessage() -> None:
     msg.set_content('Hello, World!')
     msg['From'] = ''
     msg['Subject'] = 'Test Message'
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == 'Test Message'
     assert notification.body == 'Hello, World!'
     assert notification.body_format == apprise.NotifyFormat.TEXT
@@ -25,13 +72,66 @@ def test_parsemessage() -> None:
     msg = EmailMessage()
     msg.set_content('Hello, World!')
     msg.add_alternative('Hello, <strong>World!</strong>', subtype='html')
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == '[no subject]'
     assert notification.from_ == '[no sender]'
     assert notification.body == 'Hello, <strong>World!</strong>'
     assert notification.body_format == apprise.NotifyFormat.HTML
 
 
+def test_parsecontent() -> None:
+    """Tests for parsing raw SMTP message contents."""
+    msg = EmailMessage()
+    msg.set_content('Hello, World!')
+    msg['Subject'] = 'Test Message'
+    notification = _parsecontent(_logger, msg.as_bytes(), Envelope())
+    assert notification.subject == 'Test Message'
+    assert notification.body == 'Hello, World!'
+    assert notification.body_format == apprise.NotifyFormat.TEXT
+
+
+def _pad_lines(content: bytes, end: int) -> bytes:
+    """Appends lines of filler text so that the final CRLF starts at `end`."""
+    while end - len(content) > 80:
+        content += b'a' * 76 + b'\r\n'
+    return content + b'b' * (end - len(content)) + b'\r\n'
+
+
+def test_parsecontent_chunks() -> None:
+    """Tests parsing a message that is fed to the parser in multiple chunks."""
+    content = (b'MIME-Version: 1.0\r\n'
+               b'Subject: Test Message\r\n'
+               b'Content-Type: multipart/mixed; boundary="BOUNDARY"\r\n'
+               b'\r\n'
+               b'--BOUNDARY\r\n'
+               b'Content-Type: text/plain\r\n'
+               b'\r\n')
+    # Split a CRLF across the first chunk edge...
+    content = _pad_lines(content, _FEED_CHUNK - 1)
+    assert content[_FEED_CHUNK - 1:_FEED_CHUNK + 1] == b'\r\n'
+    # ...and a MIME boundary across the second.
+    content = _pad_lines(content, 2*_FEED_CHUNK - 6)
+    content += (b'--BOUNDARY\r\n'
+                b'Content-Type: application/octet-stream\r\n'
+                b'Content-Disposition: attachment; filename="data.bin"\r\n'
+                b'Content-Transfer-Encoding: base64\r\n'
+                b'\r\n'
+                + base64.encodebytes(bytes(range(256)) * 256).replace(b'\n', b'\r\n')
+                + b'--BOUNDARY--\r\n')
+    assert content[2*_FEED_CHUNK - 4:2*_FEED_CHUNK + 6] == b'--BOUNDARY'
+    assert len(content) > 2*_FEED_CHUNK
+
+    notification = _parsecontent(_logger, content, Envelope())
+    expected = BytesParser(policy=email.policy.default).parsebytes(content)
+    assert notification.email_message.as_bytes() == expected.as_bytes()
+    assert notification.subject == 'Test Message'
+    assert notification.body.startswith('a' * 76)
+    assert notification.body.endswith('b')
+    assert len(notification.attachments) == 1
+    assert notification.attachments[0].data == bytes(range(256)) * 256
+    assert notification.attachments[0].filename == 'data.bin'
+
+
 def test_multipart() -> None:
     """Tests for email message parsing with multipart components."""
     img_name = 'bridge.jpg'
@@ -42,7 +142,7 @@ def test_multipart() -> None:
     msg.add_related(img_data, maintype='image', subtype='jpeg')
     msg['From'] = ''
     msg['Subject'] = 'Test Message'
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == 'Test Message'
     assert notification.body == 'Hello, World!'
     assert notification.body_format == apprise.NotifyFormat.TEXT
@@ -52,12 +152,26 @@ def test_multipart() -> None:
     msg.add_alternative('<strong>Hello, World!</strong>', subtype='html')
     msg['From'] = ''
     msg['Subject'] = 'Test Message'
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == 'Test Message'
     assert notification.body == '<strong>Hello, World!</strong>'
     assert notification.body_format == apprise.NotifyFormat.HTML
 
 
+def test_unreadable_body() -> None:
+    """Tests that messages with unreadable bodies are still delivered."""
+    img_name = 'bridge.jpg'
+    with open(Path(__file__).parent/img_name, 'rb') as file:
+        img_data = file.read()
+    msg = EmailMessage()
+    msg.add_related(img_data, maintype='image', subtype='jpeg')
+    msg['Subject'] = 'Test Message'
+    notification = _parsemessage(_logger, msg, Envelope())
+    assert notification.subject == 'Test Message'
+    assert notification.body == '[no body]'
+    assert notification.body_format == apprise.NotifyFormat.TEXT
+
+
 def test_parseattachments() -> None:
     """Tests for email message parsing with attachments."""
     img_name = 'bridge.jpg'
@@ -74,7 +188,7 @@ def test_parseattachments() -> None:
         subtype='jpeg',
         filename=img_name
     )
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == 'Now With Images'
     assert notification.from_ == 'sender@example.com'
     assert notification.body == 'Hello, World!'
@@ -99,7 +213,7 @@ def test_parseattachments() -> None:
         subtype='jpeg',
         filename=f'2_{img_name}'
     )
-    notification = _parsemessage(msg, Envelope())
+    notification = _parsemessage(_logger, msg, Envelope())
     assert notification.subject == 'Now With Images'
     assert notification.from_ == 'sender@example.com'
     assert notification.body == 'Hello, World!'
@@ -109,3 +223,163 @@ def test_parseattachments() -> None:
         assert attach.data == img_data
     assert notification.attachments[0].filename == f'1_{img_name}'
     assert notification.attachments[1].filename == f'2_{img_name}'
+
+    notification = _parsemessage(_logger, msg, Envelope(), max_attachments=1)
+    assert notification.body == 'Hello, World!\n\n[1 attachment(s) dropped]'
+    assert len(notification.attachments) == 1
+    assert notification.attachments[0].filename == f'1_{img_name}'
+
+
+def test_apprise_instance_cache() -> None:
+    """Tests that Apprise instances are reused for identical configurations."""
+    config = 'urls: ["json://localhost"]'
+    first = _apprise_instance(config, 'yaml', DEFAULT_ASSET)
+    assert _apprise_instance(config, 'yaml', DEFAULT_ASSET) is first
+    assert len(first) == 1
+
+    other = _apprise_instance('urls: ["json://localhost/other"]', 'yaml', DEFAULT_ASSET)
+    assert other is not first
+
+
+def test_unreadable_multipart() -> None:
+    """Tests the exception raised for multipart messages that can't be parsed."""
+    msg = EmailMessage()
+    msg.add_related('Hello, World!')
+    msg.make_mixed()
+    exc = UnreadableMultipart(msg)
+    assert exc.message is msg
+    assert str(exc) == 'unreadable multipart/mixed message'
+
+
+def test_stageattachments() -> None:
+    """Tests that attachments are written out once for all notifications."""
+    config = _make_config()
+    attach1 = EmailAttachment(data=b'one', filename='1.txt')
+    attach2 = EmailAttachment(data=b'two', filename='2.txt')
+    to_send = [
+        AppriseNotification(config='', title='', body='', attachments=[attach1]),
+        AppriseNotification(config='', title='', body='',
+                            attachments=[attach1, attach2]),
+    ]
+    attach_bases = _stageattachments(config, to_send)
+    assert len(attach_bases) == 2
+    base = attach_bases[id(attach1)]
+    path = base.path
+    assert path is not None
+    assert base.name == '1.txt'
+    with open(path, 'rb') as file:
+        assert file.read() == b'one'
+    # Reading the attachment again must not rewrite it.
+    assert base.path == path
+    for staged in attach_bases.values():
+        staged.invalidate()
+    assert not os.path.exists(path)
+
+
+def test_stageattachments_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that a failure to stage attachments leaves no files behind."""
+    created = _fail_second_mkstemp(monkeypatch)
+    to_send = [AppriseNotification(config='', title='', body='', attachments=[
+        EmailAttachment(data=b'one', filename='1.txt'),
+        EmailAttachment(data=b'two', filename='2.txt')
+    ])]
+    with pytest.raises(OSError):
+        _stageattachments(_make_config(), to_send)
+    assert len(created) == 1
+    assert not os.path.exists(created[0])
+
+
+@pytest.mark.asyncio
+async def test_handle_data_staging_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that a failure to stage attachments is reported as transient."""
+    router = SimpleRouter(senders=[
+        (_Key(user='test'), _SimpleSender(
+            config='json://localhost', config_format='text',
+            title_template=_Template('$subject'), body_template=_Template('$body'),
+            body_format=None))
+    ])
+    handler = AppriseHandler(config=_make_config(router))
+    msg = EmailMessage()
+    msg.set_content('Hello, World!')
+    msg['Subject'] = 'Test Message'
+    for name in ('1.txt', '2.txt'):
+        msg.add_attachment(name.encode(), maintype='application',
+                           subtype='octet-stream', filename=name)
+    envelope = Envelope()
+    envelope.content = msg.as_bytes()
+    envelope.rcpt_tos = ['test@mailrise.xyz']
+    created = _fail_second_mkstemp(monkeypatch)
+    result = await handler.handle_DATA(
+        cast(SMTP, None), cast(Session, SimpleNamespace(auth_data=None)), envelope)
+    assert result.startswith('450 ')
+    assert len(created) == 1
+    assert not os.path.exists(created[0])
+
+
+@pytest.mark.asyncio
+async def test_handle_data_no_attachments(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that messages without attachments skip the staging step."""
+    def stageattachments(*args: Any) -> None:
+        raise AssertionError('staged a message without attachments')
+
+    monkeypatch.setattr(mailrise.smtp, '_stageattachments', stageattachments)
+    monkeypatch.setattr(NotifyJSON, 'send', lambda self, body, **kwargs: True)
+    router = SimpleRouter(senders=[
+        (_Key(user='test'), _SimpleSender(
+            config='json://localhost/plain', config_format='text',
+            title_template=_Template('$subject'), body_template=_Template('$body'),
+            body_format=None))
+    ])
+    handler = AppriseHandler(config=_make_config(router))
+    msg = EmailMessage()
+    msg.set_content('Hello, World!')
+    msg['Subject'] = 'Test Message'
+    envelope = Envelope()
+    envelope.content = msg.as_bytes()
+    envelope.rcpt_tos = ['test@mailrise.xyz']
+    result = await handler.handle_DATA(
+        cast(SMTP, None), cast(Session, SimpleNamespace(auth_data=None)), envelope)
+    assert result == '250 OK'
+
+
+@pytest.mark.asyncio
+async def test_apprise_notify_executor() -> None:
+    """Tests that notifications are sent from the handler's own executor."""
+    submitted = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        """Records the functions submitted to it."""
+        def submit(self, fn, /, *args, **kwargs):  # type: ignore
+            submitted.append(fn)
+            return super().submit(fn, *args, **kwargs)
+
+    with RecordingExecutor(max_workers=1) as executor:
+        data = AppriseNotification(config='json://localhost:1', config_format='text',
+                                   title='Title', body='Body')
+        with pytest.raises(AppriseNotifyFailure):
+            await _apprise_notify(data, {}, executor)
+    assert len(submitted) == 1
+
+
+@pytest.mark.asyncio
+async def test_apprise_notify_concurrent(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that concurrent sends to a new configuration all reach its service."""
+    read = ConfigMemory.read
+
+    def slow_read(self: ConfigMemory, **kwargs: Any) -> Optional[str]:
+        time.sleep(0.1)
+        return cast(Optional[str], read(self, **kwargs))
+
+    sent = []
+
+    def send(self: NotifyJSON, body: str, **kwargs: Any) -> bool:
+        sent.append(body)
+        return True
+
+    monkeypatch.setattr(ConfigMemory, 'read', slow_read)
+    monkeypatch.setattr(NotifyJSON, 'send', send)
+    data = AppriseNotification(config='json://localhost/concurrent',
+                               config_format='text', title='Title', body='Body')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        await asyncio.gather(*(_apprise_notify(data, {}, executor) for _ in range(4)))
+    assert sent == ['Body'] * 4